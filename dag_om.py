@@ -5,9 +5,52 @@ from airflow.providers.google.cloud.hooks.gcs import GCSHook
 from concurrent.futures import ThreadPoolExecutor
 from airflow.hooks.base_hook import BaseHook
 from airflow.models import Variable
+from airflow.exceptions import AirflowException, AirflowSkipException
+from airflow.utils.state import State
 import requests
-import json
+import httpx
+import asyncio
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import orjson
+import gzip
 import os
+import re
+
+# Tipos de tabela cuja linhagem deve ser verificada
+ALLOWED_TABLE_TYPES = frozenset({'Regular', 'Partitioned', 'External'})
+
+# Identifica as views pelo FQN, sem diferenciar maiúsculas de minúsculas
+_VW_RE = re.compile(r'vw', re.IGNORECASE)
+
+# Buffer de escrita dos arquivos JSON gerados
+WRITE_BUFFER_SIZE = 1 << 20
+
+# Tamanho preferido dos lotes distribuídos entre as tarefas mapeadas
+LINEAGE_BATCH_SIZE = 500
+DELETE_BATCH_SIZE = 500
+
+# Máximo de instâncias por expand (max_map_length, 1024 por padrão no Airflow).
+# Acima disso o expand falha, então os lotes crescem para caber nesse limite.
+MAX_MAPPED_TASKS = 1024
+
+# Pool do Airflow que limita as tarefas simultâneas contra o OpenMetadata.
+# Deve ser criado antes da execução, ex.: airflow pools set openmetadata 4 "Chamadas ao OpenMetadata"
+OPENMETADATA_POOL = 'openmetadata'
+
+# Códigos de status transitórios que justificam uma nova tentativa
+RETRY_STATUS_CODES = frozenset({502, 503, 504})
+MAX_RETRIES = 3
+RETRY_BACKOFF_FACTOR = 0.3
+
+# Sessão única para todas as chamadas ao OpenMetadata, reaproveitando as conexões TCP/TLS
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(
+    pool_connections=64,
+    pool_maxsize=64,
+    max_retries=Retry(total=MAX_RETRIES, backoff_factor=RETRY_BACKOFF_FACTOR, status_forcelist=RETRY_STATUS_CODES),
+))
+SESSION.headers.update({'Content-Type': 'application/json'})
 
 default_args = {
     'owner': 'julia_costa',
@@ -23,32 +66,55 @@ dag = DAG(
     schedule_interval=None,
 )
 
-def get_data(url, token, after=None):
+def get_data(url, after=None):
     """
-    Faz uma requisição HTTP para a URL especificada, usando o token fornecido.
+    Faz uma requisição HTTP para a URL especificada, usando a sessão autenticada.
 
     Args:
         url: a URL para a qual a requisição será feita.
-        token: o token de autenticação.
         after: o cursor para a próxima página de resultados.
 
     Returns:
         Os dados JSON da resposta, se a requisição for bem-sucedida e "None" se a requisição falhar.
     """
 
-    headers = {
-        'Authorization': f'Bearer {token}'
-    }
-
-    params = {'after': after} if after else {}
+    # Páginas maiores reduzem o número de requisições
+    params = {'limit': 1000}
+    if after:
+        params['after'] = after
 
-    response = requests.get(url, headers=headers, params=params, verify=False)
+    response = SESSION.get(url, params=params, timeout=(5, 30))
 
     if response.status_code == 200:
-        return response.json()
+        return orjson.loads(response.content)
     else:
         raise Exception(f'Erro ao fazer requisição. Código de status: {response.status_code}')
 
+def iter_pages(url):
+    """
+    Percorre todas as páginas de resultados da URL especificada.
+    A próxima página é requisitada antes de a atual ser processada.
+
+    Args:
+        url: a URL paginada.
+
+    Yields:
+        dict: os dados JSON de cada página.
+    """
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        page = get_data(url)
+
+        while page:
+            after = (page.get('paging') or {}).get('after')
+            next_page = executor.submit(get_data, url, after) if after else None
+
+            yield page
+
+            if next_page is None:
+                break
+            page = next_page.result()
+
 def extract_fully_qualified_names(json_data):
     """
     Extrai os FQNs do JSON especificado.
@@ -62,6 +128,21 @@ def extract_fully_qualified_names(json_data):
 
     return [item['fullyQualifiedName'] for item in json_data['data']]
 
+def chunk(items, size):
+    """
+    Divide a lista especificada em no máximo MAX_MAPPED_TASKS lotes.
+
+    Args:
+        items: a lista a ser dividida.
+        size: o tamanho preferido de cada lote, aumentado quando necessário para respeitar MAX_MAPPED_TASKS.
+
+    Returns:
+        Uma lista dos lotes.
+    """
+
+    size = max(size, -(-len(items) // MAX_MAPPED_TASKS))
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
 def save_to_json(data, file_path):
     """
     Salva os dados no arquivo especificado.
@@ -71,33 +152,25 @@ def save_to_json(data, file_path):
         file_path: o caminho do arquivo para salvar os dados.
     """
 
-    with open(file_path, 'w') as file:
-        json.dump(data, file, indent=4)
+    with open(file_path, 'wb', buffering=WRITE_BUFFER_SIZE) as file:
+        file.write(orjson.dumps(data))
 
 def fetch_schemas(**kwargs):
     """
     Obtém os schemas por meio da API do OpenMetadata, paginando os resultados e salvando-os em um arquivo JSON local. 
-    Depois, o arquivo é carregado no Google Cloud Storage (GCS).
+    Depois, o arquivo é carregado no Google Cloud Storage (GCS) como registro da execução.
 
     Returns:
-        str: o caminho do arquivo JSON temporário.
+        list: os FQNs dos schemas, repassados à próxima tarefa via XCom.
     """    
     url = 'https://sandbox.open-metadata.org/api/v1/databaseSchemas?database=Ecommerce_Datawarehouse.dev'
     token = Variable.get("token_om")
+    SESSION.headers.update({'Authorization': f'Bearer {token}'})
 
     result = []
-    after = None
 
-    while True:
-        response_data = get_data(url, token, after)
-        current_data = extract_fully_qualified_names(response_data)
-        result.extend(current_data)
-
-        paging_info = response_data['paging']
-        if 'after' in paging_info:
-            after = paging_info['after']
-        else:
-            break
+    for page in iter_pages(url):
+        result.extend(extract_fully_qualified_names(page))
 
     output_data = {'data': result}
     temp_file_path = '/tmp/schemas.json'
@@ -105,77 +178,63 @@ def fetch_schemas(**kwargs):
 
     bucket_name = "bucket-om"
     hook = GCSHook(gcp_conn_id="conexao_gcp")
-    hook.upload(bucket_name=bucket_name, object_name='arquivos/schemas.json', filename=temp_file_path)
+    hook.upload(bucket_name=bucket_name, object_name='arquivos/schemas.json.gz', filename=temp_file_path, gzip=True)
 
-    print(f"schemas.json está no bucket '{bucket_name}'")
+    print(f"schemas.json.gz está no bucket '{bucket_name}'")
     print("Fase 1 completa")
 
-    return temp_file_path
+    return result
 
 def create_table_files(**kwargs):
     """
     Obtém informações como ID, FQN e URL sobre as tabelas associadas aos schemas obtidos.
-    Essas informações são formatadas em arquivos JSON individuais e carregadas no GCS.
+    Essas informações são agrupadas por schema em um único arquivo JSON carregado no GCS.
+    Os schemas são lidos do XCom da tarefa anterior, sem baixar o schemas.json novamente.
 
     Args:
         **kwargs: argumentos do Airflow.
+
+    Returns:
+        str: o nome do objeto criado no GCS, repassado à próxima tarefa via XCom.
     """    
     bucket_name = "bucket-om"
-    hook = GCSHook(gcp_conn_id="conexao_gcp")
 
-    temp_file_path = '/tmp/schemas.json'
-    hook.download(bucket_name=bucket_name, object_name='arquivos/schemas.json', filename=temp_file_path)
-
-    with open(temp_file_path, 'r') as file:
-        databaseSchema_names = json.load(file)['data']
+    databaseSchema_names = kwargs['ti'].xcom_pull(task_ids='fetch_schemas')
 
     base_url = ' https://sandbox.open-metadata.org/api/v1/tables?databaseSchema='
     token = Variable.get("token_om")
-    
-    gcs_folder_path = 'arquivos/tabelas/'
+    SESSION.headers.update({'Authorization': f'Bearer {token}'})
+
+    gcs_object_name = 'arquivos/tabelas.json.gz'
+    all_tables = {}
 
     for name in databaseSchema_names:
         url = f'{base_url}{name}'
-        after = None
         response_data = []
 
-        while True:
-            json_data = get_data(url, token, after)
-
-            if not json_data:
-                break
-
-            filtered_data = []
-            for obj in json_data['data']:
+        for page in iter_pages(url):
+            for obj in page['data']:
                 filtered_object = {
                     'id': obj['id'],
                     'fullyQualifiedName': obj['fullyQualifiedName'],
                     'href': obj['href'],
                     'tableType': obj['tableType'],
                 }
-                filtered_data.append(filtered_object)
+                response_data.append(filtered_object)
 
-            response_data.extend(filtered_data)
+        all_tables[name] = response_data
 
-            if 'paging' in json_data and 'after' in json_data['paging']:
-                after = json_data['paging']['after']
-            else:
-                break
-
-        output_file_name = f'{name}.json'
-        
-        output_data = {'data': response_data}
-        output_json = json.dumps(output_data, indent=4)
-        
-        gcs_object_name = f'{gcs_folder_path}{output_file_name}'
-        hook.upload(bucket_name=bucket_name, object_name=gcs_object_name, filename=None, data=output_json)
+    hook = GCSHook(gcp_conn_id="conexao_gcp")
+    hook.upload(bucket_name=bucket_name, object_name=gcs_object_name, filename=None, data=orjson.dumps(all_tables), gzip=True)
 
-    print(f"Arquivos criados em '{gcs_folder_path}'")
+    print(f"Tabelas salvas em '{gcs_object_name}'")
     print("Fase 2 completa")
 
+    return gcs_object_name
+
 def get_lineage_by_id(id):
     """
-    Obtém a linhagem de uma tabela específica por meio de uma chamada à API OpenMetadata.
+    Obtém a linhagem de uma tabela específica por meio de uma chamada à API OpenMetadata, usando a sessão autenticada.
 
     Args:
         id (str): o identificador da tabela para a qual a linhagem será obtida.
@@ -185,18 +244,12 @@ def get_lineage_by_id(id):
     """
 
     url = f' https://sandbox.open-metadata.org/api/v1/lineage/table/{id}'
-    token = Variable.get("token_om")
-
-    headers = {
-        'Authorization': f'Bearer {token}',
-        'Content-Type': 'application/json'
-    }
 
     try:
-        response = requests.get(url, headers=headers, verify=False)
+        response = SESSION.get(url, timeout=(5, 30))
 
         if response.status_code == 200:
-            linhagem = response.json()
+            linhagem = orjson.loads(response.content)
             return linhagem
         else:
             print(f'Erro ao obter a linhagem para o ID {id}. Status code: {response.status_code}')
@@ -205,63 +258,92 @@ def get_lineage_by_id(id):
         print(f'Ocorreu um erro: {e}')
         return None
 
-def extract_and_save_lineage(**kwargs):
+def list_table_ids(**kwargs):
     """
-    Extrai a linhagem para cada tabela a partir dos arquivos JSON obtidos anteriormente.
-    Os resultados são salvos em um arquivo JSON local, que também é carregado no GCS.
+    Lista os IDs das tabelas cuja linhagem deve ser verificada, a partir do arquivo JSON de tabelas obtido anteriormente.
+    Os IDs são divididos em lotes, e cada lote é processado por uma instância mapeada da próxima tarefa.
 
     Args:
         **kwargs: argumentos do Airflow.
+
+    Returns:
+        list: os argumentos de cada instância mapeada, repassados via XCom.
     """
 
-    folder_path = "arquivos/tabelas/"
-    lineage_file_path = '/tmp/resultados_linhagem.json'
-    gcs_object_name = 'arquivos/resultados_linhagem.json'
     bucket_name = "bucket-om"
 
-    resultados = []
+    hook = GCSHook(gcp_conn_id="conexao_gcp")
+    tables_object_name = kwargs['ti'].xcom_pull(task_ids='create_table_files')
+    # O GCSHook não define o Content-Encoding, então a descompressão é feita aqui
+    json_data = gzip.decompress(hook.download(bucket_name=bucket_name, object_name=tables_object_name))
+
+    ids = []
+    for dados_json in orjson.loads(json_data).values():
+        for item in dados_json:
+            if item.get('tableType') in ALLOWED_TABLE_TYPES:
+                ids.append(item['id'])
+
+    # Uma tabela listada em mais de um schema é consultada uma única vez
+    ids = list(dict.fromkeys(ids))
+
+    return [{'ids': batch} for batch in chunk(ids, LINEAGE_BATCH_SIZE)]
+
+def extract_and_save_lineage(ids, **kwargs):
+    """
+    Extrai a linhagem para um lote de tabelas. Executada como tarefa mapeada, uma instância por lote.
+    Os resultados são salvos em um arquivo JSON Lines local, que também é carregado no GCS.
+
+    Args:
+        ids (list): os IDs das tabelas do lote.
+        **kwargs: argumentos do Airflow.
+
+    Returns:
+        str: o nome do objeto criado no GCS, repassado à próxima tarefa via XCom.
+    """
+
+    # O run_id evita que execuções simultâneas da DAG sobrescrevam os lotes umas das outras
+    run_id = kwargs['run_id']
+    map_index = kwargs['ti'].map_index
+    lineage_file_path = f'/tmp/resultados_linhagem_{run_id}_{map_index}.json'
+    gcs_object_name = f'arquivos/linhagem/{run_id}/resultados_linhagem_{map_index}.json.gz'
+    bucket_name = "bucket-om"
+    token = Variable.get("token_om")
+    SESSION.headers.update({'Authorization': f'Bearer {token}'})
+
+    # As chamadas de linhagem são limitadas pela rede, então são feitas em paralelo.
+    # Cada resultado aceito é gravado como uma linha JSON assim que fica pronto.
+    with ThreadPoolExecutor(max_workers=32) as executor, open(lineage_file_path, 'wb', buffering=WRITE_BUFFER_SIZE) as outfile:
+        for id, linhagem in zip(ids, executor.map(get_lineage_by_id, ids)):
+            if linhagem is not None and 'nodes' in linhagem and len(linhagem['nodes']) > 0:
+                # As condições das arestas não dependem dos nós, então são avaliadas uma única vez
+                edges_ok = (
+                    ('downstreamEdges' not in linhagem or not linhagem['downstreamEdges'] or 'lineageDetails' not in linhagem['downstreamEdges'][0])
+                    and ('upstreamEdges' not in linhagem or not linhagem['upstreamEdges'] or 'lineageDetails' not in linhagem['upstreamEdges'][0])
+                )
+
+                if edges_ok and not any(_VW_RE.search(node.get('fullyQualifiedName', '')) for node in linhagem['nodes']):
+                    outfile.write(orjson.dumps({
+                        'id': id,
+                        'linhagem': linhagem
+                    }))
+                    outfile.write(b'\n')
 
     hook = GCSHook(gcp_conn_id="conexao_gcp")
-    files = hook.list(bucket_name, prefix=folder_path)
-
-    for file_name in files:
-        if file_name.endswith('.json'):
-            json_data = hook.download(bucket_name=bucket_name, object_name=file_name)
-            dados_json = json.loads(json_data)['data']
-
-            def processar_item(item):
-                if item.get('tableType') == 'Regular' or item.get('tableType') == 'Partitioned' or item.get('tableType') == 'External':
-                    id = item['id']
-                    linhagem = get_lineage_by_id(id)
-                    if linhagem is not None and 'nodes' in linhagem and len(linhagem['nodes']) > 0:
-                        for node in linhagem['nodes']:
-                            fully_qualified_name = node.get('fullyQualifiedName', '')
-                            if 'vw' not in fully_qualified_name.lower():
-                                if 'downstreamEdges' not in linhagem or not linhagem['downstreamEdges'] or 'lineageDetails' not in linhagem['downstreamEdges'][0]:
-                                    if 'upstreamEdges' not in linhagem or not linhagem['upstreamEdges'] or 'lineageDetails' not in linhagem['upstreamEdges'][0]:
-                                        resultados.append({
-                                            'id': id,
-                                            'linhagem': linhagem
-                                        })
-
-            for item in dados_json:
-                processar_item(item)
-
-    resultados_formatados = json.dumps(resultados, indent=4)
-
-    with open(lineage_file_path, 'w') as outfile:
-        outfile.write(resultados_formatados)
-
-    hook.upload(bucket_name=bucket_name, object_name=gcs_object_name, filename=lineage_file_path)
+    hook.upload(bucket_name=bucket_name, object_name=gcs_object_name, filename=lineage_file_path, gzip=True)
 
     print(f"Resultados salvos em '{gcs_object_name}'")
-    print("Fase 3 completa")
+    print(f"Lote {map_index} da fase 3 completo")
+
+    return gcs_object_name
 
-def exclude_lineage(from_id, to_id):
+async def exclude_lineage(client, semaphore, from_id, to_id):
     """
     Deleta a linhagem entre duas tabelas específicas por meio da API OpenMetadata.
+    Erros de conexão e respostas 502, 503 e 504 são tentados novamente, com o mesmo limite usado pela sessão do requests.
 
     Args:
+        client (httpx.AsyncClient): o cliente autenticado usado na requisição.
+        semaphore (asyncio.Semaphore): limita o número de deleções simultâneas.
         from_id (str): ID da tabela de origem.
         to_id (str): ID da tabela de destino.
 
@@ -269,50 +351,101 @@ def exclude_lineage(from_id, to_id):
         dict: o status da operação (erro ou sucesso).
     """
 
-    url = f' https://sandbox.open-metadata.org/api/v1/lineage/table/{from_id}/table/{to_id}'
-    token = Variable.get("token_om")
+    url = f'https://sandbox.open-metadata.org/api/v1/lineage/table/{from_id}/table/{to_id}'
+
+    async with semaphore:
+        try:
+            for attempt in range(MAX_RETRIES + 1):
+                try:
+                    response = await client.delete(url)
+                except httpx.TransportError:
+                    # Falhas de conexão e de leitura também são tentadas novamente
+                    if attempt == MAX_RETRIES:
+                        raise
+                else:
+                    if response.status_code not in RETRY_STATUS_CODES or attempt == MAX_RETRIES:
+                        break
+                await asyncio.sleep(RETRY_BACKOFF_FACTOR * (2 ** attempt))
+
+            if response.status_code == 200:
+                print(f'Linhagem entre {from_id} e {to_id} foi deletada com sucesso.')
+                return {'from_id': from_id, 'to_id': to_id, 'status': 'Deletada com sucesso'}
+            else:
+                print(f'Erro ao deletar a linhagem entre {from_id} e {to_id}. Status code: {response.status_code}')
+                return {'from_id': from_id, 'to_id': to_id, 'status': 'Erro ao deletar'}
+        except Exception as e:
+            print(f'Ocorreu um erro: {e}')
+            return {'from_id': from_id, 'to_id': to_id, 'status': 'Erro ao deletar'}
+
+async def exclude_lineages(pairs, token):
+    """
+    Deleta a linhagem de todos os pares de tabelas de forma concorrente.
+    Com HTTP/2, as deleções compartilham poucas conexões TLS.
+
+    Args:
+        pairs (list): pares (from_id, to_id) cuja linhagem será deletada.
+        token (str): o token de autenticação.
+
+    Returns:
+        list: o status de cada operação, na mesma ordem dos pares.
+    """
 
     headers = {
         'Authorization': f'Bearer {token}',
         'Content-Type': 'application/json'
     }
+    limits = httpx.Limits(max_connections=32, max_keepalive_connections=32)
+    timeout = httpx.Timeout(30.0, connect=5.0)
+    semaphore = asyncio.Semaphore(64)
 
-    try:
-        response = requests.delete(url, headers=headers, verify=False)
-
-        if response.status_code == 200:
-            print(f'Linhagem entre {from_id} e {to_id} foi deletada com sucesso.')
-            return {'from_id': from_id, 'to_id': to_id, 'status': 'Deletada com sucesso'}
-        else:
-            print(f'Erro ao deletar a linhagem entre {from_id} e {to_id}. Status code: {response.status_code}')
-            return {'from_id': from_id, 'to_id': to_id, 'status': 'Erro ao deletar'}
-    except Exception as e:
-        print(f'Ocorreu um erro: {e}')
-        return {'from_id': from_id, 'to_id': to_id, 'status': 'Erro ao deletar'}
-
-processed_lineage_pairs = set()
+    async with httpx.AsyncClient(http2=True, limits=limits, headers=headers, timeout=timeout) as client:
+        return await asyncio.gather(*[exclude_lineage(client, semaphore, from_id, to_id) for from_id, to_id in pairs])
 
-def delete_lineage(**kwargs):
+def collect_lineage_pairs(**kwargs):
     """
-    Processa os resultados da linhagem para identificar as tabelas relacionadas.
-    A linhagem entre essas tabelas é deletada utilizando a API OpenMetadata.
+    Processa os resultados da linhagem de todos os lotes para identificar as tabelas relacionadas.
+    Os pares de tabelas são divididos em lotes, e cada lote é deletado por uma instância mapeada da próxima tarefa.
 
     Args:
         **kwargs: argumentos do Airflow.
-    """    
-    resultados = []
 
-    with open('/tmp/resultados_linhagem.json', 'r') as f:
-        data = json.load(f)
+    Returns:
+        list: os argumentos de cada instância mapeada, repassados via XCom.
+    """
 
-        for item in data:
-            from_id = item['id']
-            downstream_edges = item['linhagem'].get('downstreamEdges', [])
-            upstream_edges = item['linhagem'].get('upstreamEdges', [])
+    bucket_name = "bucket-om"
+    resultados = []
+    pairs = []
+    # Local à execução, para que pares de execuções anteriores não impeçam novas deleções
+    processed_lineage_pairs = set()
+
+    hook = GCSHook(gcp_conn_id="conexao_gcp")
+    # Sem tabelas elegíveis, a tarefa mapeada é pulada e não há XCom
+    lineage_object_names = kwargs['ti'].xcom_pull(task_ids='get_lineage_and_save_to_gcs') or []
+
+    for lineage_object_name in lineage_object_names:
+        # O lote é baixado para um arquivo e lido linha a linha, sem carregar tudo na memória
+        lineage_file_path = f"/tmp/{lineage_object_name.replace('/', '_')}"
+        hook.download(bucket_name=bucket_name, object_name=lineage_object_name, filename=lineage_file_path)
+
+        with gzip.open(lineage_file_path, 'rb') as f:
+            for line in f:
+                item = orjson.loads(line)
+                from_id = item['id']
+                downstream_edges = item['linhagem'].get('downstreamEdges', [])
+                upstream_edges = item['linhagem'].get('upstreamEdges', [])
+
+                for edge in downstream_edges:
+                    to_id = edge.get('toEntity')
+                    if not from_id or not to_id:
+                        continue
+
+                    # A chave não depende da direção, então A->B e B->A são o mesmo par
+                    key = frozenset((from_id, to_id))
+                    if key in processed_lineage_pairs:
+                        continue
+                    processed_lineage_pairs.add(key)
 
-            for edge in downstream_edges:
-                to_id = edge.get('toEntity')
-                if from_id and to_id and ((from_id, to_id) not in processed_lineage_pairs and (to_id, from_id) not in processed_lineage_pairs):
                     from_fully_qualified_name = item['linhagem']['entity']['fullyQualifiedName']
                     to_fully_qualified_name = edge.get('toEntityFullyQualifiedName', '')
 
@@ -321,14 +454,19 @@ def delete_lineage(**kwargs):
                         'from_fully_qualified_name': from_fully_qualified_name,
                         'to_id': to_id,
                         'to_fully_qualified_name': to_fully_qualified_name,
-                        'status': exclude_lineage(from_id, to_id)['status']
                     })
+                    pairs.append((from_id, to_id))
+
+                for edge in upstream_edges:
+                    to_id = edge.get('fromEntity')
+                    if not from_id or not to_id:
+                        continue
 
-                    processed_lineage_pairs.add((from_id, to_id))
+                    key = frozenset((from_id, to_id))
+                    if key in processed_lineage_pairs:
+                        continue
+                    processed_lineage_pairs.add(key)
 
-            for edge in upstream_edges:
-                to_id = edge.get('fromEntity')
-                if from_id and to_id and ((from_id, to_id) not in processed_lineage_pairs and (to_id, from_id) not in processed_lineage_pairs):
                     from_fully_qualified_name = item['linhagem']['entity']['fullyQualifiedName']
                     to_fully_qualified_name = edge.get('fromEntityFullyQualifiedName', '')
 
@@ -337,22 +475,78 @@ def delete_lineage(**kwargs):
                         'from_fully_qualified_name': from_fully_qualified_name,
                         'to_id': to_id,
                         'to_fully_qualified_name': to_fully_qualified_name,
-                        'status': exclude_lineage(to_id, from_id)['status']
                     })
+                    pairs.append((to_id, from_id))
 
-                    processed_lineage_pairs.add((to_id, from_id))
+    batches = zip(chunk(resultados, DELETE_BATCH_SIZE), chunk(pairs, DELETE_BATCH_SIZE))
+    return [{'resultados': resultados_lote, 'pairs': pairs_lote} for resultados_lote, pairs_lote in batches]
 
-    with open('/tmp/resultados_delecao.json', 'w') as outfile:
-        json.dump(resultados, outfile, indent=4)
+def delete_lineage(resultados, pairs, **kwargs):
+    """
+    Deleta a linhagem de um lote de pares de tabelas utilizando a API OpenMetadata.
+    Executada como tarefa mapeada, uma instância por lote.
+
+    Args:
+        resultados (list): as informações de cada par do lote.
+        pairs (list): pares (from_id, to_id) cuja linhagem será deletada.
+        **kwargs: argumentos do Airflow.
+
+    Returns:
+        list: as informações de cada par com o status da deleção, repassadas via XCom.
+    """
+
+    token = Variable.get("token_om")
+    status = asyncio.run(exclude_lineages(pairs, token))
+
+    for resultado, status_delecao in zip(resultados, status):
+        resultado['status'] = status_delecao['status']
+
+    return resultados
+
+def save_deletion_results(**kwargs):
+    """
+    Reúne o status das deleções de todos os lotes em um arquivo JSON local, que também é carregado no GCS.
+    Roda mesmo quando algum lote falha, para salvar o status dos lotes concluídos.
+
+    Args:
+        **kwargs: argumentos do Airflow.
+    """
+
+    # Sem a coleta dos pares, nada foi deletado e o relatório anterior é preservado
+    collect_ti = kwargs['dag_run'].get_task_instance('collect_lineage_pairs')
+    if collect_ti is None or collect_ti.state != State.SUCCESS:
+        raise AirflowSkipException('A coleta dos pares não foi concluída, o relatório não será sobrescrito')
+
+    # Lotes pulados ou com falha não têm XCom; os demais são salvos mesmo assim
+    resultados = []
+    for resultados_lote in kwargs['ti'].xcom_pull(task_ids='delete_lineage') or []:
+        resultados.extend(resultados_lote or [])
+
+    if kwargs['ti'].xcom_pull(task_ids='collect_lineage_pairs') and not resultados:
+        raise AirflowSkipException('Nenhum lote de deleção foi concluído, o relatório não será sobrescrito')
+
+    with open('/tmp/resultados_delecao.json', 'wb', buffering=WRITE_BUFFER_SIZE) as outfile:
+        outfile.write(orjson.dumps(resultados))
 
     bucket_name = "bucket-om"
-    gcs_object_name = 'arquivos/resultados_delecao.json'
+    gcs_object_name = 'arquivos/resultados_delecao.json.gz'
     hook = GCSHook(gcp_conn_id="conexao_gcp")
-    hook.upload(bucket_name=bucket_name, object_name=gcs_object_name, filename='/tmp/resultados_delecao.json')
+    hook.upload(bucket_name=bucket_name, object_name=gcs_object_name, filename='/tmp/resultados_delecao.json', gzip=True)
 
     print("Deleção completa, os resultados foram salvos na GCS")
     print("Fase 4 completa")
 
+def check_failures(**kwargs):
+    """
+    Marca a execução da DAG como falha quando alguma tarefa anterior falhou.
+    Como o relatório de deleção roda mesmo após falhas, sem esta tarefa a execução terminaria como sucesso.
+
+    Args:
+        **kwargs: argumentos do Airflow.
+    """
+
+    raise AirflowException('Uma ou mais tarefas da limpeza de linhagem falharam')
+
 fetch_schemas_task = PythonOperator(
     task_id="fetch_schemas",
     python_callable=fetch_schemas,
@@ -367,18 +561,62 @@ create_table_files_task = PythonOperator(
     dag=dag,
 )
 
-get_lineage_and_save_to_gcs_task = PythonOperator(
+list_table_ids_task = PythonOperator(
+    task_id="list_table_ids",
+    python_callable=list_table_ids,
+    provide_context=True,
+    dag=dag,
+)
+
+get_lineage_and_save_to_gcs_task = PythonOperator.partial(
     task_id="get_lineage_and_save_to_gcs",
     python_callable=extract_and_save_lineage,
     provide_context=True,
+    pool=OPENMETADATA_POOL,
+    dag=dag,
+).expand(op_kwargs=list_table_ids_task.output)
+
+collect_lineage_pairs_task = PythonOperator(
+    task_id="collect_lineage_pairs",
+    python_callable=collect_lineage_pairs,
+    provide_context=True,
+    trigger_rule='none_failed',
     dag=dag,
 )
 
-delete_lineage_task = PythonOperator(
+delete_lineage_task = PythonOperator.partial(
     task_id="delete_lineage",
     python_callable=delete_lineage,
     provide_context=True,
+    pool=OPENMETADATA_POOL,
+    dag=dag,
+).expand(op_kwargs=collect_lineage_pairs_task.output)
+
+save_deletion_results_task = PythonOperator(
+    task_id="save_deletion_results",
+    python_callable=save_deletion_results,
+    provide_context=True,
+    trigger_rule='all_done',
+    dag=dag,
+)
+
+fetch_schemas_task >> create_table_files_task >> list_table_ids_task >> get_lineage_and_save_to_gcs_task
+get_lineage_and_save_to_gcs_task >> collect_lineage_pairs_task >> delete_lineage_task >> save_deletion_results_task
+
+check_failures_task = PythonOperator(
+    task_id="check_failures",
+    python_callable=check_failures,
+    provide_context=True,
+    trigger_rule='one_failed',
     dag=dag,
 )
 
-fetch_schemas_task >> create_table_files_task >> get_lineage_and_save_to_gcs_task >> delete_lineage_task
\ No newline at end of file
+[
+    fetch_schemas_task,
+    create_table_files_task,
+    list_table_ids_task,
+    get_lineage_and_save_to_gcs_task,
+    collect_lineage_pairs_task,
+    delete_lineage_task,
+    save_deletion_results_task,
+] >> check_failures_task
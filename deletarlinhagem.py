@@ -1,34 +1,77 @@
 from datetime import datetime, timedelta
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import orjson
 import os
+import re
 
-def get_data(url, token, after=None):
+# Tipos de tabela cuja linhagem deve ser verificada
+ALLOWED_TABLE_TYPES = frozenset({'Regular', 'Partitioned', 'External'})
+
+# Identifica as views pelo FQN, sem diferenciar maiúsculas de minúsculas
+_VW_RE = re.compile(r'vw', re.IGNORECASE)
+
+# Buffer de escrita dos arquivos JSON gerados
+WRITE_BUFFER_SIZE = 1 << 20
+
+# Sessão única para todas as chamadas ao OpenMetadata, reaproveitando as conexões TCP/TLS
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(
+    pool_connections=64,
+    pool_maxsize=64,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504]),
+))
+SESSION.headers.update({'Content-Type': 'application/json'})
+
+def get_data(url, after=None):
     """
-    Faz uma requisição HTTP para a URL especificada, usando o token fornecido.
+    Faz uma requisição HTTP para a URL especificada, usando a sessão autenticada.
 
     Args:
         url: a URL para a qual a requisição será feita.
-        token: o token de autenticação.
         after: o cursor para a próxima página de resultados.
 
     Returns:
         Os dados JSON da resposta, se a requisição for bem-sucedida e "None" se a requisição falhar.
     """
 
-    headers = {
-        'Authorization': f'Bearer {token}'
-    }
-
-    params = {'after': after} if after else {}
+    # Páginas maiores reduzem o número de requisições
+    params = {'limit': 1000}
+    if after:
+        params['after'] = after
 
-    response = requests.get(url, headers=headers, params=params)
+    response = SESSION.get(url, params=params, timeout=(5, 30))
 
     if response.status_code == 200:
-        return response.json()
+        return orjson.loads(response.content)
     else:
         raise Exception(f'Erro ao fazer requisição. Código de status: {response.status_code}')
 
+def iter_pages(url):
+    """
+    Percorre todas as páginas de resultados da URL especificada.
+
+    Args:
+        url: a URL paginada.
+
+    Yields:
+        dict: os dados JSON de cada página.
+    """
+
+    after = None
+
+    while True:
+        page = get_data(url, after)
+        if not page:
+            break
+
+        yield page
+
+        after = (page.get('paging') or {}).get('after')
+        if not after:
+            break
+
 def extract_fully_qualified_names(json_data):
     """
     Extrai os FQNs do JSON especificado.
@@ -51,8 +94,8 @@ def save_to_json(data, file_path):
         file_path: o caminho do arquivo para salvar os dados.
     """
 
-    with open(file_path, 'w') as file:
-        json.dump(data, file, indent=4)
+    with open(file_path, 'wb', buffering=WRITE_BUFFER_SIZE) as file:
+        file.write(orjson.dumps(data))
 
 def fetch_schemas():
     """
@@ -62,20 +105,12 @@ def fetch_schemas():
     url = 'https://sandbox.open-metadata.org/api/v1/databaseSchemas?database=Ecommerce_Datawarehouse.dev'
     # Insira seu token aqui
     token = "token-openmetadata"
+    SESSION.headers.update({'Authorization': f'Bearer {token}'})
 
     result = []
-    after = None
-
-    while True:
-        response_data = get_data(url, token, after)
-        current_data = extract_fully_qualified_names(response_data)
-        result.extend(current_data)
 
-        paging_info = response_data['paging']
-        if 'after' in paging_info:
-            after = paging_info['after']
-        else:
-            break
+    for page in iter_pages(url):
+        result.extend(extract_fully_qualified_names(page))
 
     output_data = {'data': result}
     temp_file_path = 'schemas.json'
@@ -92,46 +127,33 @@ def create_table_files():
 
     temp_file_path = 'schemas.json'
 
-    with open(temp_file_path, 'r') as file:
-        databaseSchema_names = json.load(file)['data']
+    with open(temp_file_path, 'rb') as file:
+        databaseSchema_names = orjson.loads(file.read())['data']
 
     base_url = 'https://sandbox.open-metadata.org/api/v1/tables?databaseSchema='
     # Insira seu token aqui
-    token = "token-openmetadata"  
+    token = "token-openmetadata"
+    SESSION.headers.update({'Authorization': f'Bearer {token}'})
 
     for name in databaseSchema_names:
         url = f'{base_url}{name}'
-        after = None
         response_data = []
 
-        while True:
-            json_data = get_data(url, token, after)
-
-            if not json_data:
-                break
-
-            filtered_data = []
-            for obj in json_data['data']:
+        for page in iter_pages(url):
+            for obj in page['data']:
                 filtered_object = {
                     'id': obj['id'],
                     'fullyQualifiedName': obj['fullyQualifiedName'],
                     'href': obj['href'],
                     'tableType': obj['tableType'],
                 }
-                filtered_data.append(filtered_object)
-
-            response_data.extend(filtered_data)
-
-            if 'paging' in json_data and 'after' in json_data['paging']:
-                after = json_data['paging']['after']
-            else:
-                break
+                response_data.append(filtered_object)
 
         output_file_name = f'{name}.json'
         output_data = {'data': response_data}
 
-        with open(output_file_name, 'w') as outfile:
-            json.dump(output_data, outfile, indent=4)
+        with open(output_file_name, 'wb', buffering=WRITE_BUFFER_SIZE) as outfile:
+            outfile.write(orjson.dumps(output_data))
         
         print(f"Arquivo '{output_file_name}' criado")
         
@@ -141,7 +163,7 @@ def create_table_files():
 
 def get_lineage_by_id(id):
     """
-    Obtém a linhagem de uma tabela específica por meio de uma chamada à API OpenMetadata.
+    Obtém a linhagem de uma tabela específica por meio de uma chamada à API OpenMetadata, usando a sessão autenticada.
 
     Args:
         id (str): o identificador da tabela para a qual a linhagem será obtida.
@@ -151,19 +173,12 @@ def get_lineage_by_id(id):
     """
 
     url = f' https://sandbox.open-metadata.org/api/v1/lineage/table/{id}'
-    # Insira seu token aqui
-    token = "token-openmetadata"  
-
-    headers = {
-        'Authorization': f'Bearer {token}',
-        'Content-Type': 'application/json'
-    }
 
     try:
-        response = requests.get(url, headers=headers)
+        response = SESSION.get(url, timeout=(5, 30))
 
         if response.status_code == 200:
-            lineage = response.json()
+            lineage = orjson.loads(response.content)
             return lineage
         else:
             print(f'Erro ao obter a linhagem para o ID {id}. Status code: {response.status_code}')
@@ -175,44 +190,51 @@ def get_lineage_by_id(id):
 def extract_and_save_lineage():
     """
     Extrai a linhagem para cada tabela a partir dos arquivos JSON obtidos anteriormente.
-    Os resultados são salvos em um arquivo JSON local.
+    Os resultados são salvos em um arquivo JSON Lines local.
     """
 
     lineage_file_path = 'resultados_linhagem.json'
-
-    with open('schemas.json', 'r') as f:
-        databaseSchema_names = json.load(f)['data']
-
-    resultados = []
-
-    for name in databaseSchema_names:
-        with open(f'{name}.json', 'r') as file:
-            data = json.load(file)['data']
-
-            for item in data:
-                if item.get('tableType') == 'Regular' or item.get('tableType') == 'Partitioned' or item.get('tableType') == 'External':
-                    id = item['id']
-                    lineage = get_lineage_by_id(id)
-                    if lineage is not None and 'nodes' in lineage and len(lineage['nodes']) > 0:
-                        for node in lineage['nodes']:
-                            fully_qualified_name = node.get('fullyQualifiedName', '')
-                            if 'vw' not in fully_qualified_name.lower():
-                                if 'downstreamEdges' not in lineage or not lineage['downstreamEdges'] or 'lineageDetails' not in lineage['downstreamEdges'][0]:
-                                    if 'upstreamEdges' not in lineage or not lineage['upstreamEdges'] or 'lineageDetails' not in lineage['upstreamEdges'][0]:
-                                        resultados.append({
-                                            'id': id,
-                                            'linhagem': lineage
-                                        })
-
-    with open(lineage_file_path, 'w') as outfile:
-        json.dump(resultados, outfile, indent=4)
+    # Insira seu token aqui
+    token = "token-openmetadata"
+    SESSION.headers.update({'Authorization': f'Bearer {token}'})
+
+    with open('schemas.json', 'rb') as f:
+        databaseSchema_names = orjson.loads(f.read())['data']
+
+    # Uma tabela listada em mais de um schema é consultada uma única vez
+    seen_ids = set()
+
+    # Cada resultado aceito é gravado como uma linha JSON assim que fica pronto
+    with open(lineage_file_path, 'wb', buffering=WRITE_BUFFER_SIZE) as outfile:
+        for name in databaseSchema_names:
+            with open(f'{name}.json', 'rb') as file:
+                data = orjson.loads(file.read())['data']
+
+                for item in data:
+                    if item.get('tableType') in ALLOWED_TABLE_TYPES and item['id'] not in seen_ids:
+                        id = item['id']
+                        seen_ids.add(id)
+                        lineage = get_lineage_by_id(id)
+                        if lineage is not None and 'nodes' in lineage and len(lineage['nodes']) > 0:
+                            # As condições das arestas não dependem dos nós, então são avaliadas uma única vez
+                            edges_ok = (
+                                ('downstreamEdges' not in lineage or not lineage['downstreamEdges'] or 'lineageDetails' not in lineage['downstreamEdges'][0])
+                                and ('upstreamEdges' not in lineage or not lineage['upstreamEdges'] or 'lineageDetails' not in lineage['upstreamEdges'][0])
+                            )
+
+                            if edges_ok and not any(_VW_RE.search(node.get('fullyQualifiedName', '')) for node in lineage['nodes']):
+                                outfile.write(orjson.dumps({
+                                    'id': id,
+                                    'linhagem': lineage
+                                }))
+                                outfile.write(b'\n')
 
     print(f"Resultados salvos localmente")
     print("Fase 3 completa")
 
 def exclude_lineage(from_id, to_id):
     """
-    Deleta a linhagem entre duas tabelas específicas por meio da API OpenMetadata.
+    Deleta a linhagem entre duas tabelas específicas por meio da API OpenMetadata, usando a sessão autenticada.
 
     Args:
         from_id (str): ID da tabela de origem.
@@ -223,16 +245,9 @@ def exclude_lineage(from_id, to_id):
     """
 
     url = f' https://sandbox.open-metadata.org/api/v1/lineage/table/{from_id}/table/{to_id}'
-    # Insira seu token aqui
-    token = "token-openmetadata" 
-
-    headers = {
-        'Authorization': f'Bearer {token}',
-        'Content-Type': 'application/json'
-    }
 
     try:
-        response = requests.delete(url, headers=headers)
+        response = SESSION.delete(url, timeout=(5, 30))
 
         if response.status_code == 200:
             print(f'Linhagem entre {from_id} e {to_id} foi deletada com sucesso.')
@@ -250,12 +265,17 @@ def delete_lineage():
     A linhagem entre essas tabelas é deletada utilizando a API OpenMetadata.
     """
 
-    resultados = []
+    # Insira seu token aqui
+    token = "token-openmetadata"
+    SESSION.headers.update({'Authorization': f'Bearer {token}'})
 
-    with open('resultados_linhagem.json', 'r') as f:
-        data = json.load(f)
+    # Cada par de tabelas aparece na linhagem das duas pontas, então a linhagem é
+    # deletada uma única vez por par, na direção em que o par foi encontrado primeiro
+    pending = {}
 
-        for item in data:
+    with open('resultados_linhagem.json', 'rb') as f:
+        for line in f:
+            item = orjson.loads(line)
             from_id = item['id']
             downstream_edges = item['linhagem'].get('downstreamEdges', [])
             upstream_edges = item['linhagem'].get('upstreamEdges', [])
@@ -263,23 +283,24 @@ def delete_lineage():
             for edge in downstream_edges:
                 to_id = edge.get('toEntity')
                 if from_id and to_id:
-                    resultados.append({
-                        'from_id': from_id,
-                        'to_id': to_id,
-                        'status': exclude_lineage(from_id, to_id)['status']
-                    })
+                    pending.setdefault(frozenset((from_id, to_id)), (from_id, to_id, (from_id, to_id)))
 
             for edge in upstream_edges:
                 to_id = edge.get('fromEntity')
                 if from_id and to_id:
-                    resultados.append({
-                        'from_id': from_id,
-                        'to_id': to_id,
-                        'status': exclude_lineage(to_id, from_id)['status']
-                    })
-
-    with open('resultados_delecao.json', 'w') as outfile:
-        json.dump(resultados, outfile, indent=4)
+                    pending.setdefault(frozenset((from_id, to_id)), (from_id, to_id, (to_id, from_id)))
+
+    resultados = []
+
+    for from_id, to_id, pair in pending.values():
+        resultados.append({
+            'from_id': from_id,
+            'to_id': to_id,
+            'status': exclude_lineage(*pair)['status']
+        })
+
+    with open('resultados_delecao.json', 'wb', buffering=WRITE_BUFFER_SIZE) as outfile:
+        outfile.write(orjson.dumps(resultados))
 
     print("Deleção completa, os resultados foram salvos localmente")
     print("Fase 4 completa")